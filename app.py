@@ -1,10 +1,21 @@
+import asyncio
+import functools
+import io
+import time
+from pathlib import Path
 import streamlit as st
 import yfinance as yf
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import date
 import ta
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from utils._njit import HAS_NUMBA
+from utils.indicators import bbands_loop, macd_loop, rsi_loop, sma, vwap
 
 # --- Page Configuration ---
 st.set_page_config(layout="wide", page_title="📈 Stock Market Dashboard", initial_sidebar_state="expanded")
@@ -19,104 +30,274 @@ tickers_input = st.sidebar.text_input("Enter up to 10 tickers (comma-separated)"
 period = st.sidebar.selectbox("Select Period", ['1mo', '3mo', '6mo', '1y', '2y', '5y', 'max'], index=1)
 interval = st.sidebar.selectbox("Select Interval", ['1d', '1h', '30m', '15m'], index=0)
 indicators = st.sidebar.multiselect("Technical Indicators", ['MACD', 'RSI', 'SMA', 'EMA', 'BBANDS', 'VWAP'], default=['MACD', 'RSI'])
-show_volume = st.sidebar.toggle("Show Volume", value=True)
 
 # --- Helper Function: Fetch Data ---
-def fetch_data(ticker):
+CACHE_DIR = Path(".cache")
+CACHE_TTL = 900
+FAILURE_TTL = 60
+
+def clean_data(df):
+    df.index = pd.to_datetime(df.index)
+    df = df[['Open', 'High', 'Low', 'Close', 'Volume']].dropna()
+    df[['Open', 'High', 'Low', 'Close']] = df[['Open', 'High', 'Low', 'Close']].apply(pd.to_numeric, errors='coerce')
+    return df.dropna()
+
+async def fetch_each(tickers, period, interval, limit=4):
+    # Per-ticker downloads run on worker threads, at most `limit` in flight at once
+    sem = asyncio.Semaphore(limit)
+
+    async def fetch(ticker):
+        async with sem:
+            return await asyncio.to_thread(yf.download, ticker, period=period, interval=interval, auto_adjust=True, multi_level_index=False)
+
+    return await asyncio.gather(*[fetch(t) for t in tickers], return_exceptions=True)
+
+def cache_path(ticker, period, interval):
+    return CACHE_DIR / f"{ticker.replace('/', '_')}_{period}_{interval}.parquet"
+
+def read_cached(ticker, period, interval):
+    # Parquet copy on disk survives restarts and is shared by every session
+    path = cache_path(ticker, period, interval)
+    if path.exists() and time.time() - path.stat().st_mtime < CACHE_TTL:
+        try:
+            return pd.read_parquet(path)
+        except Exception:
+            pass
+    return pd.DataFrame()
+
+def write_cached(ticker, period, interval, df):
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        df.to_parquet(cache_path(ticker, period, interval))
+    except Exception:
+        pass
+
+class FetchError(Exception):
+    # Carries whatever did download so a partial failure can still be shown
+    def __init__(self, data, errors):
+        super().__init__(", ".join(errors))
+        self.data = data
+        self.errors = errors
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def download_data(tickers, period, interval):
+    data = {ticker: read_cached(ticker, period, interval) for ticker in tickers}
+    to_fetch = [ticker for ticker in tickers if data[ticker].empty]
+    if not to_fetch:
+        return data
+
+    # One batched request for every uncached ticker; yfinance fans it out over its own threads
     try:
-        df = yf.download(ticker, period=period, interval=interval)
-        df.index = pd.to_datetime(df.index)
-        df = df[['Open', 'High', 'Low', 'Close', 'Volume']].dropna()
-        df[['Open', 'High', 'Low', 'Close']] = df[['Open', 'High', 'Low', 'Close']].apply(pd.to_numeric, errors='coerce')
-        return df.dropna()
-    except Exception as e:
-        st.warning(f"⚠️ Failed to fetch data for {ticker}: {e}")
-        return pd.DataFrame()
+        multi = yf.download(" ".join(to_fetch), period=period, interval=interval, auto_adjust=True, group_by='ticker', threads=True)
+    except Exception:
+        multi = pd.DataFrame()
+    for ticker in to_fetch:
+        try:
+            df = multi[ticker] if isinstance(multi.columns, pd.MultiIndex) else multi
+            data[ticker] = clean_data(df)
+        except Exception:
+            pass
+
+    # Tickers the batch dropped are retried concurrently, one request each
+    errors = {}
+    missing = [ticker for ticker in to_fetch if data[ticker].empty]
+    if missing:
+        results = asyncio.run(fetch_each(missing, period, interval))
+        for ticker, result in zip(missing, results):
+            if isinstance(result, Exception):
+                errors[ticker] = result
+                continue
+            try:
+                data[ticker] = clean_data(result)
+            except Exception as e:
+                errors[ticker] = e
+
+    for ticker in to_fetch:
+        if not data[ticker].empty:
+            write_cached(ticker, period, interval, data[ticker])
+
+    # Raising keeps the failure out of this long-lived cache (fetch_recent holds it for
+    # FAILURE_TTL); the tickers that did download are on disk, so a retry only refetches the rest
+    if any(df.empty for df in data.values()):
+        raise FetchError(data, errors)
+    return data
+
+@st.cache_data(ttl=FAILURE_TTL, show_spinner=False)
+def fetch_recent(tickers, period, interval):
+    # Failures are held only briefly so a bad ticker isn't refetched on every rerun
+    try:
+        return download_data(tickers, period, interval), {}
+    except FetchError as e:
+        return e.data, {ticker: str(error) for ticker, error in e.errors.items()}
+
+def fetch_data(tickers, period, interval):
+    data, errors = fetch_recent(tickers, period, interval)
+    for ticker, error in errors.items():
+        st.warning(f"⚠️ Failed to fetch data for {ticker}: {error}")
+    return data
 
 # --- Helper Function: Add Indicators ---
-def add_indicators(df, selected):
-    close = df['Close'].squeeze()
+INDICATOR_COLUMNS = {
+    'MACD': ['MACD', 'MACD_Signal'],
+    'RSI': ['RSI'],
+    'SMA': ['SMA'],
+    'EMA': ['EMA'],
+    'BBANDS': ['BB_H', 'BB_L'],
+    'VWAP': ['VWAP'],
+}
 
-    if 'RSI' in selected:
-        df['RSI'] = ta.momentum.RSIIndicator(close=close).rsi()
+@st.cache_resource
+def warm_up_numba():
+    # Pays the JIT compile cost once per process rather than on the first rerun that needs it
+    close = np.linspace(1.0, 2.0, 64)
+    rsi_loop(close, 14)
+    macd_loop(close)
+    bbands_loop(close)
 
-    if 'MACD' in selected:
-        macd = ta.trend.MACD(close=close)
-        df['MACD'] = macd.macd()
-        df['MACD_Signal'] = macd.macd_signal()
+def add_indicators(df):
+    # All indicators are always computed so toggling one never invalidates the cache; draw_chart
+    # and export_csv pick the selected ones. Arrays are attached in one assign(), leaving `df` untouched
+    close = df['Close'].squeeze()
+    close_a = close.to_numpy(dtype=np.float64)
+    cols = {}
 
-    if 'SMA' in selected:
-        df['SMA'] = close.rolling(window=20).mean()
+    if HAS_NUMBA:
+        cols['RSI'] = rsi_loop(close_a, 14)
+        cols['MACD'], cols['MACD_Signal'] = macd_loop(close_a)
+    else:
+        cols['RSI'] = ta.momentum.RSIIndicator(close=close).rsi().to_numpy()
+        macd = ta.trend.MACD(close=close)
+        cols['MACD'] = macd.macd().to_numpy()
+        cols['MACD_Signal'] = macd.macd_signal().to_numpy()
 
-    if 'EMA' in selected:
-        df['EMA'] = close.ewm(span=20).mean()
+    cols['SMA'] = sma(close_a, 20)
+    cols['EMA'] = close.ewm(span=20).mean().to_numpy()
 
-    if 'BBANDS' in selected:
+    if HAS_NUMBA:
+        cols['BB_H'], cols['BB_L'] = bbands_loop(close_a)
+    else:
         bb = ta.volatility.BollingerBands(close=close)
-        df['BB_H'] = bb.bollinger_hband()
-        df['BB_L'] = bb.bollinger_lband()
+        cols['BB_H'] = bb.bollinger_hband().to_numpy()
+        cols['BB_L'] = bb.bollinger_lband().to_numpy()
+
+    if 'Volume' in df.columns:
+        cols['VWAP'] = vwap(close_a, df['Volume'].squeeze().to_numpy(dtype=np.float64))
 
-    if 'VWAP' in selected and 'Volume' in df.columns:
-        df['VWAP'] = (close * df['Volume']).cumsum() / df['Volume'].cumsum()
+    # Chart and CSV precision doesn't need float64; halves what gets serialized per trace
+    return df.assign(**{name: col.astype(np.float32, copy=False) for name, col in cols.items()})
 
-    return df
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def indicators_for(df):
+    # Keyed on the frame's contents, so a fresh download never reuses stale indicators
+    return add_indicators(df)
+
+# --- Helper Function: Downsample ---
+def downsample(df, n=2000):
+    # Thin long histories to roughly screen resolution: candles and volume are aggregated
+    # per bucket so no extremes are lost, indicator lines are sampled at the bucket start
+    if len(df) <= n:
+        return df
+    idx = np.unique(np.linspace(0, len(df) - 1, n).astype(int))
+    last = np.append(idx[1:] - 1, len(df) - 1)
+    out = df.iloc[idx].copy()
+    out['High'] = np.maximum.reduceat(df['High'].to_numpy(), idx)
+    out['Low'] = np.minimum.reduceat(df['Low'].to_numpy(), idx)
+    out['Close'] = df['Close'].to_numpy()[last]
+    out['Volume'] = np.add.reduceat(df['Volume'].to_numpy(), idx)
+    return out
 
 # --- Helper Function: Draw Chart ---
-def draw_chart(df, ticker):
+# (indicator, column, trace name, line style, subplot row), in drawing order
+LINE_TRACES = [
+    ('SMA', 'SMA', "SMA", dict(color='blue'), 1),
+    ('EMA', 'EMA', "EMA", dict(color='red'), 1),
+    ('BBANDS', 'BB_H', "BB Upper", dict(color='gray'), 1),
+    ('BBANDS', 'BB_L', "BB Lower", dict(color='gray'), 1),
+    ('VWAP', 'VWAP', "VWAP", dict(color='orange', dash='dot'), 1),
+    ('MACD', 'MACD', "MACD", dict(color='cyan'), 2),
+    ('MACD', 'MACD_Signal', "MACD Signal", dict(color='white', dash='dot'), 2),
+    ('RSI', 'RSI', "RSI", dict(color='violet'), 3),
+]
+
+@functools.lru_cache(maxsize=64)
+def trace_plan(selected):
+    # Resolved once per indicator selection instead of re-testing every branch on each redraw
+    return tuple((column, name, line, row) for indicator, column, name, line, row in LINE_TRACES if indicator in selected)
+
+def draw_chart(df, ticker, selected, show_volume):
+    df = downsample(df)
     fig = make_subplots(
         rows=3, cols=1, shared_xaxes=True,
         row_heights=[0.6, 0.2, 0.2], vertical_spacing=0.02,
         subplot_titles=[f"{ticker} Price", "MACD", "RSI"]
     )
 
+    # Traces are collected as (trace, row) and added in one batch to validate the figure once
+    traces = []
+
     # Candlestick
-    fig.add_trace(go.Candlestick(x=df.index, open=df['Open'], high=df['High'],
-                                 low=df['Low'], close=df['Close'], name="Candlestick"), row=1, col=1)
+    traces.append((go.Candlestick(x=df.index, open=df['Open'], high=df['High'],
+                                  low=df['Low'], close=df['Close'], name="Candlestick"), 1))
 
     # Volume
     if show_volume:
-        fig.add_trace(go.Bar(x=df.index, y=df['Volume'], name="Volume", opacity=0.3), row=1, col=1)
-
-    # Overlay Indicators
-    if 'SMA' in df.columns:
-        fig.add_trace(go.Scatter(x=df.index, y=df['SMA'], name="SMA", line=dict(color='blue')), row=1, col=1)
-    if 'EMA' in df.columns:
-        fig.add_trace(go.Scatter(x=df.index, y=df['EMA'], name="EMA", line=dict(color='red')), row=1, col=1)
-    if 'BB_H' in df.columns:
-        fig.add_trace(go.Scatter(x=df.index, y=df['BB_H'], name="BB Upper", line=dict(color='gray')), row=1, col=1)
-        fig.add_trace(go.Scatter(x=df.index, y=df['BB_L'], name="BB Lower", line=dict(color='gray')), row=1, col=1)
-    if 'VWAP' in df.columns:
-        fig.add_trace(go.Scatter(x=df.index, y=df['VWAP'], name="VWAP", line=dict(color='orange', dash='dot')), row=1, col=1)
-
-    # MACD
-    if 'MACD' in df.columns:
-        fig.add_trace(go.Scatter(x=df.index, y=df['MACD'], name="MACD", line=dict(color='cyan')), row=2, col=1)
-        fig.add_trace(go.Scatter(x=df.index, y=df['MACD_Signal'], name="MACD Signal", line=dict(color='white', dash='dot')), row=2, col=1)
-
-    # RSI
-    if 'RSI' in df.columns:
-        fig.add_trace(go.Scatter(x=df.index, y=df['RSI'], name="RSI", line=dict(color='violet')), row=3, col=1)
-
-    fig.update_layout(template='plotly_dark', height=900, margin=dict(t=30, b=30))
+        traces.append((go.Bar(x=df.index, y=df['Volume'], name="Volume", opacity=0.3), 1))
+
+    # Indicator lines, from the plan specialized for this selection
+    for column, name, line, row in trace_plan(selected):
+        if column in df.columns:
+            traces.append((go.Scattergl(x=df.index, y=df[column], name=name, line=line), row))
+
+    fig.add_traces([t for t, _ in traces], rows=[r for _, r in traces], cols=[1] * len(traces))
+    fig.update_layout(template='plotly_dark', height=900, margin=dict(t=30, b=30), uirevision=ticker)
     st.plotly_chart(fig, use_container_width=True)
 
+# Older Streamlit releases only ship the experimental name
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+@fragment
+def render(df, ticker, selected):
+    # Display-only toggles rerun just this chart, never the fetch or indicator stages
+    show_volume = st.toggle("Show Volume", value=True, key=f"show_volume_{ticker}")
+    draw_chart(df, ticker, selected, show_volume)
+
+# --- Helper Function: Export CSV ---
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def export_csv(selected, data_dict):
+    # Arrow's multi-threaded writer instead of pandas' row-by-row to_csv
+    # Ticker comes from the concat keys rather than a per-frame assign() copy
+    full_data = pd.concat(data_dict.values(), keys=data_dict.keys(), names=['Ticker']).reset_index(level=0)
+    columns = ['Ticker', 'Open', 'High', 'Low', 'Close', 'Volume'] + [c for name in selected for c in INDICATOR_COLUMNS[name]]
+    full_data = full_data[[c for c in columns if c in full_data.columns]]
+    full_data['Ticker'] = full_data['Ticker'].astype('category')
+    # Tickers from different exchanges carry different timezones; formatting the index here keeps
+    # each bar in its own zone instead of Arrow coercing everything to the first ticker's
+    full_data.index = full_data.index.astype(str)
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(full_data.reset_index(), preserve_index=False), buf)
+    return buf.getvalue()
+
 # --- Main Execution ---
-ticker_list = [t.strip().upper() for t in tickers_input.split(",")][:10]
+if HAS_NUMBA:
+    warm_up_numba()
+
+ticker_list = [t.strip().upper() for t in tickers_input.split(",") if t.strip()][:10]
 data_dict = {}
+raw_data = fetch_data(tuple(ticker_list), period, interval)
 
 for ticker in ticker_list:
-    df = fetch_data(ticker)
+    df = raw_data.get(ticker, pd.DataFrame())
     if not df.empty:
-        df = add_indicators(df, indicators)
+        df = indicators_for(df)
         data_dict[ticker] = df
         st.markdown(f"### {ticker}")
-        draw_chart(df, ticker)
+        render(df, ticker, tuple(sorted(indicators)))
     else:
         st.warning(f"No data for {ticker}.")
 
 # --- Download Option ---
 if data_dict:
     st.subheader("📥 Download Combined Data")
-    full_data = pd.concat([df.assign(Ticker=ticker) for ticker, df in data_dict.items()])
-    csv = full_data.to_csv().encode('utf-8')
+    # Built only when the button is clicked, so indicator toggles never pay for the export
+    csv = functools.partial(export_csv, tuple(sorted(indicators)), data_dict)
     st.download_button("Download CSV", data=csv, file_name="stock_data.csv", mime='text/csv')
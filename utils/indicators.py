@@ -0,0 +1,97 @@
+import numpy as np
+
+from utils._njit import njit
+
+
+@njit(cache=True)
+def rsi_loop(close, n):
+    # Wilder's RSI in one pass; matches ta.momentum.RSIIndicator (adjust=False, min_periods=n)
+    size = close.shape[0]
+    out = np.full(size, np.nan)
+    alpha = 1.0 / n
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, size):
+        diff = close[i] - close[i - 1]
+        gain = diff if diff > 0 else 0.0
+        loss = -diff if diff < 0 else 0.0
+        avg_gain += alpha * (gain - avg_gain)
+        avg_loss += alpha * (loss - avg_loss)
+        if i >= n - 1:
+            out[i] = 100.0 if avg_loss == 0 else 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    return out
+
+
+@njit(cache=True)
+def macd_loop(close, fast=12, slow=26, sig=9):
+    # Fast, slow and signal EMAs in one pass; matches ta.trend.MACD (adjust=False, min_periods=span)
+    size = close.shape[0]
+    out_macd = np.full(size, np.nan)
+    out_signal = np.full(size, np.nan)
+    if size == 0:
+        return out_macd, out_signal
+    a = 2.0 / (fast + 1)
+    b = 2.0 / (slow + 1)
+    c = 2.0 / (sig + 1)
+    ema_fast = close[0]
+    ema_slow = close[0]
+    signal = 0.0
+    for i in range(size):
+        ema_fast += a * (close[i] - ema_fast)
+        ema_slow += b * (close[i] - ema_slow)
+        if i < slow - 1:
+            continue
+        m = ema_fast - ema_slow
+        out_macd[i] = m
+        # The signal EMA is seeded by the first valid MACD value
+        signal = m if i == slow - 1 else signal + c * (m - signal)
+        if i >= slow + sig - 2:
+            out_signal[i] = signal
+    return out_macd, out_signal
+
+
+def sma(x, w):
+    # Rolling mean from one cumulative sum: V[t] = (C[t] - C[t-w]) / w
+    out = np.full(len(x), np.nan)
+    if len(x) < w:
+        return out
+    c = np.empty(len(x) + 1)
+    c[0] = 0.0
+    np.cumsum(x, out=c[1:])
+    out[w - 1:] = (c[w:] - c[:-w]) / w
+    return out
+
+
+def vwap(close, volume):
+    # Cumulative price*volume over cumulative volume, reusing the pv buffer in place
+    pv = np.multiply(close, volume)
+    np.cumsum(pv, out=pv)
+    vc = np.cumsum(volume)
+    # Leading zero volume (common on index tickers) gives NaN, as the pandas expression did
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(pv, vc, out=pv)
+    return pv
+
+
+@njit(cache=True)
+def bbands_loop(close, w=20, k=2.0):
+    # Rolling mean and population std from running sum and sum of squares; matches
+    # ta.volatility.BollingerBands (ddof=0, min_periods=w)
+    size = close.shape[0]
+    high = np.full(size, np.nan)
+    low = np.full(size, np.nan)
+    s = 0.0
+    ss = 0.0
+    for i in range(size):
+        s += close[i]
+        ss += close[i] * close[i]
+        if i >= w:
+            s -= close[i - w]
+            ss -= close[i - w] * close[i - w]
+        if i >= w - 1:
+            m = s / w
+            v = ss / w - m * m
+            sd = np.sqrt(v) if v > 0 else 0.0
+            high[i] = m + k * sd
+            low[i] = m - k * sd
+    return high, low